@@ -4,6 +4,7 @@ import sqlite3
 import json
 import uuid
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 from threading import Lock
@@ -14,6 +15,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
+from .media import can_derive, derive_failed, media_kind, shutdown_pool
+
 APP_DIR = Path(__file__).resolve().parent           # backend/app
 BACK_DIR = APP_DIR.parent                           # backend
 DATA_FILE = BACK_DIR / "data" / "entities.json"
@@ -39,6 +42,22 @@ def save_entities(rows: List[Dict[str, Any]]) -> None:
     DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
     DATA_FILE.write_text(json.dumps(rows, indent=2, ensure_ascii=False), encoding="utf-8")
 
+def with_media_urls(row: Dict[str, Any]) -> Dict[str, Any]:
+    # ingested evidence stores only its attachment id; thumb/preview URLs are
+    # worked out per read so a failed derive drops them instead of a broken <img>
+    meta = row.get("meta") or {}
+    aid = meta.get("attachmentId")
+    if not aid:
+        return row
+    row = dict(row, meta=dict(meta))
+    thumb = f"/api/attachments/{aid}/thumb"
+    ok = can_derive(media_kind(meta.get("mime", ""), row.get("title", ""))) and not derive_failed(meta.get("sha256", ""))
+    row["meta"]["thumbUrl"] = thumb if ok else None
+    row["meta"]["previewUrl"] = f"/api/attachments/{aid}/preview" if ok else None
+    urls = [u for u in (row.get("imageUrls") or []) if u != thumb]
+    row["imageUrls"] = [thumb] + urls if ok else urls
+    return row
+
 # ----------- Models (accept both camel + snake where people tend to mix) -----------
 
 class EntityCreate(BaseModel):
@@ -72,7 +91,13 @@ class Entity(EntityCreate):
     createdAt: str
     updatedAt: str
 
-app = FastAPI(title="lynx-api", version="0.2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # stop thumbnail/preview workers (app/media.py)
+    shutdown_pool()
+
+app = FastAPI(title="lynx-api", version="0.2.0", lifespan=lifespan)
 
 
 
@@ -106,7 +131,19 @@ def health():
 
 @app.get("/api/pins")
 def list_pins() -> List[Dict[str, Any]]:
-    return load_entities()
+    return [with_media_urls(r) for r in load_entities()]
+
+async def broadcast_entity(row: Dict[str, Any]) -> None:
+    # push to SSE subscribers
+    async with sub_lock:
+        dead = []
+        for q in subscribers:
+            try:
+                q.put_nowait(row)
+            except Exception:
+                dead.append(q)
+        for q in dead:
+            subscribers.discard(q)
 
 @app.post("/api/pins")
 async def create_pin(payload: EntityCreate) -> Dict[str, Any]:
@@ -128,16 +165,7 @@ async def create_pin(payload: EntityCreate) -> Dict[str, Any]:
         rows.insert(0, row)
         save_entities(rows)
 
-    # broadcast to SSE subscribers
-    async with sub_lock:
-        dead = []
-        for q in subscribers:
-            try:
-                q.put_nowait(row)
-            except Exception:
-                dead.append(q)
-        for q in dead:
-            subscribers.discard(q)
+    await broadcast_entity(row)
 
     return row
 
@@ -367,6 +395,8 @@ from typing import Optional, List
 from fastapi import UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 
+from .media import schedule_derivatives
+
 # allow iPad / remote browsers
 try:
     app.add_middleware(
@@ -463,6 +493,32 @@ def _insert_pin(kind: str, title: str, notes: str, lat: float, lng: float, sever
     con.close()
     return pid
 
+def _evidence_entity(aid: str, name: str, mime: str, size: int, sha: str, lat: float, lng: float) -> Dict[str, Any]:
+    download = f"/api/attachments/{aid}"
+    entity = EntityCreate(
+        type="evidence",
+        title=name,
+        description=f"file evidence (sha256 {sha[:12]}…)",
+        lat=lat,
+        lng=lng,
+        severity=3,
+        links=[download],
+        # imageUrls / thumbUrl / previewUrl are filled in on read (with_media_urls)
+        meta={
+            "source": "ingest",
+            "attachmentId": aid,
+            "sha256": sha,
+            "mime": mime,
+            "size": size,
+            "downloadUrl": download,
+        },
+    )
+    row = entity.model_dump(by_alias=False)
+    row["id"] = str(uuid.uuid4())
+    row["createdAt"] = now_iso()
+    row["updatedAt"] = row["createdAt"]
+    return row
+
 def _list_pins():
     con = _db()
     pins = [dict(r) for r in con.execute("SELECT * FROM pins ORDER BY created_at DESC").fetchall()]
@@ -550,6 +606,12 @@ async def api_ingest(
                 size=len(raw),
                 sha256=sha
             )
+            # thumbnails/previews are built off-request in the media pool;
+            # never let that fail the upload (the thumb endpoint re-queues)
+            try:
+                schedule_derivatives(out, sha, mime=(f.content_type or ""), name=safe_name)
+            except Exception:
+                pass
             # create a linked object on the map for this evidence item
             _insert_pin(
                 kind="evidence",
@@ -560,6 +622,14 @@ async def api_ingest(
                 severity=3,
                 attachment_ids=[aid]
             )
+            # mirror it as an entity so /api/pins + the SSE stream (what the UI reads)
+            # get the thumbnail instead of the full-size original
+            entity = _evidence_entity(aid, safe_name, (f.content_type or ""), len(raw), sha, dlat, dlng)
+            with write_lock:
+                rows = load_entities()
+                rows.insert(0, entity)
+                save_entities(rows)
+            await broadcast_entity(with_media_urls(entity))
             created_attachments += 1
             created_pins += 1
 
@@ -604,3 +674,98 @@ def api_wipe():
 # ============================
 # LYNX_DB_PATCH_END
 # ============================
+
+# ============================
+# LYNX_MEDIA_PATCH_BEGIN
+# Adds:
+# - GET /api/attachments/{id}           (original, Range via FileResponse)
+# - GET /api/attachments/{id}/thumb     (256px jpeg, sha256-keyed cache)
+# - GET /api/attachments/{id}/preview   (1024px jpeg, sha256-keyed cache)
+# Derivatives are generated in a process pool (app/media.py). A cache miss
+# queues the job and waits briefly; if it's still not ready (or failed) the
+# <img> gets an uncached placeholder instead of a broken image.
+# ============================
+import base64
+
+from fastapi.responses import FileResponse, Response
+
+from .media import VARIANTS, derived_path
+
+DERIVE_WAIT_S = 3.0
+
+# uploads share the UI's origin: only these render inline, everything else
+# (html, svg, xml, ...) is forced to download as opaque bytes
+INLINE_MIME = {
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp",
+    "video/mp4", "video/webm", "video/quicktime",
+    "application/pdf",
+}
+_SAFE_HEADERS = {"x-content-type-options": "nosniff", "content-security-policy": "sandbox"}
+# 1x1 transparent gif
+_PLACEHOLDER_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+def _get_file_attachment(aid: str):
+    con = _db()
+    row = con.execute("SELECT * FROM attachments WHERE id = ?", (aid,)).fetchone()
+    con.close()
+    if row is None or row["kind"] != "file" or not row["path"]:
+        raise HTTPException(status_code=404, detail="attachment not found")
+    a = dict(row)
+    p = Path(a["path"]).resolve()
+    # only ever serve from the evidence vault
+    if UPLOAD_DIR.resolve() not in p.parents or not p.is_file():
+        raise HTTPException(status_code=404, detail="attachment file missing")
+    a["_file"] = p
+    return a
+
+@app.api_route("/api/attachments/{aid}", methods=["GET", "HEAD"])
+def api_attachment_download(aid: str):
+    a = _get_file_attachment(aid)
+    headers = {"cache-control": "private, max-age=3600", **_SAFE_HEADERS}
+    if a["sha256"]:
+        headers["etag"] = f'"{a["sha256"]}"'
+    mime = (a["mime"] or "").split(";")[0].strip().lower()
+    inline = mime in INLINE_MIME
+    # FileResponse does Range / If-Range / 416. Under uvicorn the body is read in
+    # threaded 64 KB chunks; there is no zero-copy sendfile on this server.
+    return FileResponse(
+        a["_file"],
+        media_type=mime if inline else "application/octet-stream",
+        filename=a["name"],
+        content_disposition_type="inline" if inline else "attachment",
+        headers=headers,
+    )
+
+@app.api_route("/api/attachments/{aid}/{variant}", methods=["GET", "HEAD"])
+def api_attachment_derived(aid: str, variant: str):
+    if variant not in VARIANTS:
+        raise HTTPException(status_code=404, detail="unknown variant")
+    a = _get_file_attachment(aid)
+    sha = a["sha256"]
+    if not sha or not can_derive(media_kind(a["mime"], a["name"])):
+        raise HTTPException(status_code=404, detail="no preview for this attachment")
+    try:
+        out = derived_path(sha, variant)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="no preview for this attachment")
+    if not out.is_file():
+        # returns the in-flight job if there is one; None when failed/unsupported
+        fut = schedule_derivatives(a["_file"], sha, mime=a["mime"], name=a["name"])
+        if fut is not None:
+            try:
+                fut.result(timeout=DERIVE_WAIT_S)
+            except Exception:
+                pass
+    if out.is_file():
+        # content-addressed: safe to cache forever
+        return FileResponse(
+            out,
+            media_type="image/jpeg",
+            headers={"cache-control": "public, max-age=31536000, immutable", "etag": f'"{sha}.{variant}"', **_SAFE_HEADERS},
+        )
+    # still deriving, or derive failed: /api/pins stops listing it once marked failed
+    return Response(_PLACEHOLDER_GIF, media_type="image/gif", headers={"cache-control": "no-store", **_SAFE_HEADERS})
+
+# ============================
+# LYNX_MEDIA_PATCH_END
+# ============================
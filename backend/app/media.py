@@ -0,0 +1,220 @@
+"""
+LYNX media helpers:
+- thumbnail / preview derivation for image + video attachments (process pool)
+- derived files are keyed by sha256 and cached on disk
+
+Kept out of main.py so pool workers can import it without pulling in the app.
+"""
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+
+DERIVED_DIR = Path(__file__).resolve().parent / "derived"
+
+# resolved once; can_derive() runs per attachment in listings
+FFMPEG = shutil.which("ffmpeg")
+
+# variant -> (max edge px, jpeg quality)
+VARIANTS: Dict[str, Tuple[int, int]] = {
+    "thumb": (256, 75),
+    "preview": (1024, 82),
+}
+
+_SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# ----------- derivation (runs inside pool workers) -----------
+
+def media_kind(mime: str, name: str = "") -> Optional[str]:
+    mime = (mime or "").lower()
+    if mime.startswith("image/svg"):
+        return None  # not rasterizable here, and never rendered inline
+    if mime.startswith("image/"):
+        return "image"
+    if mime.startswith("video/"):
+        return "video"
+    ext = Path(name or "").suffix.lower()
+    if ext in (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"):
+        return "image"
+    if ext in (".mp4", ".mov", ".m4v", ".webm", ".mkv", ".avi"):
+        return "video"
+    return None
+
+def derived_path(sha256: str, variant: str) -> Path:
+    if not _SHA_RE.match(sha256 or "") or variant not in VARIANTS:
+        raise ValueError("bad derivative key")
+    return DERIVED_DIR / sha256[:2] / f"{sha256}.{variant}.jpg"
+
+def failed_marker(sha256: str) -> Path:
+    # written by the parent when a derive raises; stops endless re-queueing
+    return DERIVED_DIR / sha256[:2] / f"{sha256}.failed"
+
+def derive_failed(sha256: str) -> bool:
+    return bool(_SHA_RE.match(sha256 or "")) and failed_marker(sha256).exists()
+
+def can_derive(kind: Optional[str]) -> bool:
+    if kind == "image":
+        return Image is not None
+    if kind == "video":
+        return FFMPEG is not None and Image is not None
+    return False
+
+def _atomic_target(out: Path) -> Path:
+    out.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=out.name + ".", suffix=".tmp", dir=str(out.parent))
+    os.close(fd)
+    return Path(tmp)
+
+def _derive_image(src: Path, sha256: str) -> None:
+    with Image.open(src) as im:
+        im.draft("RGB", (VARIANTS["preview"][0], VARIANTS["preview"][0]))  # cheap JPEG downscale on decode
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        # biggest first so each step shrinks an already-small image
+        for variant, (edge, quality) in sorted(VARIANTS.items(), key=lambda kv: -kv[1][0]):
+            out = derived_path(sha256, variant)
+            if out.exists():
+                continue
+            im.thumbnail((edge, edge))
+            tmp = _atomic_target(out)
+            try:
+                im.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+                os.replace(tmp, out)
+            finally:
+                tmp.unlink(missing_ok=True)
+
+def _derive_video(src: Path, sha256: str) -> None:
+    # one decode: ffmpeg writes the preview frame, Pillow shrinks it to the thumb
+    preview = derived_path(sha256, "preview")
+    if not preview.exists():
+        edge, quality = VARIANTS["preview"]
+        tmp = _atomic_target(preview)
+        try:
+            # scale before thumbnail so its frame batch is held at preview size, not source size
+            subprocess.run(
+                [
+                    FFMPEG, "-nostdin", "-loglevel", "error", "-y",
+                    "-i", str(src),
+                    "-vf", f"scale='min({edge},iw)':'min({edge},ih)':force_original_aspect_ratio=decrease,thumbnail",
+                    "-frames:v", "1",
+                    "-q:v", str(max(2, min(31, (100 - quality) // 3))),
+                    "-f", "image2", str(tmp),
+                ],
+                check=True,
+                timeout=120,
+            )
+            os.replace(tmp, preview)
+        finally:
+            tmp.unlink(missing_ok=True)
+    _derive_image(preview, sha256)
+
+def derive(src: str, sha256: str, kind: str) -> Dict[str, str]:
+    """Pool entrypoint. Returns {variant: path} for every derivative on disk."""
+    p = Path(src)
+    if kind == "image":
+        _derive_image(p, sha256)
+    elif kind == "video":
+        _derive_video(p, sha256)
+    return {v: str(derived_path(sha256, v)) for v in VARIANTS if derived_path(sha256, v).exists()}
+
+# ----------- pool (parent process) -----------
+
+# a file that keeps killing its worker (decoder segfault, OOM) is marked
+# failed after this many broken pools instead of being retried forever
+MAX_CRASHES = 3
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending: Dict[str, Future] = {}
+_crashes: Dict[str, int] = {}
+_pool_lock = Lock()
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.environ.get("LYNX_DERIVE_WORKERS", "")))
+    except ValueError:
+        return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+def _new_pool() -> ProcessPoolExecutor:
+    # spawn, not fork: this runs inside a threaded server process
+    return ProcessPoolExecutor(max_workers=_workers(), mp_context=multiprocessing.get_context("spawn"))
+
+def _mark_failed(sha256: str, reason: str) -> None:
+    try:
+        m = failed_marker(sha256)
+        m.parent.mkdir(parents=True, exist_ok=True)
+        m.write_text(reason[:500], encoding="utf-8")
+    except Exception:
+        pass
+
+def have_derivatives(sha256: str) -> bool:
+    return all(derived_path(sha256, v).exists() for v in VARIANTS)
+
+def schedule_derivatives(src: Path, sha256: str, mime: str = "", name: str = "") -> Optional[Future]:
+    """
+    Queue thumbnail/preview generation. No-op when cached, already queued,
+    or the media type / toolchain isn't available.
+    """
+    global _pool
+    kind = media_kind(mime, name)
+    if not _SHA_RE.match(sha256 or "") or not can_derive(kind) or have_derivatives(sha256) or derive_failed(sha256):
+        return None
+    with _pool_lock:
+        fut = _pending.get(sha256)
+        if fut is not None:
+            return fut
+        if _pool is None:
+            _pool = _new_pool()
+        try:
+            fut = _pool.submit(derive, str(src), sha256, kind)
+        except (BrokenProcessPool, RuntimeError):
+            # pool broke (or shut down) before a _done callback reset it: one fresh try
+            _pool = _new_pool()
+            try:
+                fut = _pool.submit(derive, str(src), sha256, kind)
+            except (BrokenProcessPool, RuntimeError):
+                return None
+        _pending[sha256] = fut
+
+    # a failed derive just means no preview: mark it so listings stop offering one
+    def _done(f: Future, key: str = sha256) -> None:
+        global _pool
+        with _pool_lock:
+            _pending.pop(key, None)
+        if f.cancelled():
+            return
+        exc = f.exception()
+        if exc is None:
+            return
+        if isinstance(exc, BrokenProcessPool):
+            # a worker died; maybe this file, maybe a neighbour. Next schedule gets a fresh pool.
+            with _pool_lock:
+                if _pool is not None and _pool._broken:
+                    _pool = None
+                n = _crashes[key] = _crashes.get(key, 0) + 1
+            if n >= MAX_CRASHES:
+                _mark_failed(key, f"worker crashed {n} times")
+            return
+        _mark_failed(key, f"{type(exc).__name__}: {exc}")
+
+    fut.add_done_callback(_done)
+    return fut
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+        _pending.clear()
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)